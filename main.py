@@ -1,7 +1,11 @@
 import os
 import logging
 import asyncio
-from typing import List
+import hashlib
+import re
+import string
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
 
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
@@ -16,11 +20,10 @@ from telegram.ext import (
     filters,
 )
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 import httpx
-from collections import deque, OrderedDict
+from collections import deque
 import time
-import threading
 from aiohttp import web
 
 
@@ -39,28 +42,64 @@ ASK_NAME, ASK_JM, ASK_CATEGORY, ASK_DESCRIPTION, ASK_SCREENSHOT, CONFIRM_SEND =
 # Admin reply conversation states
 ADMIN_REPLY_INPUT = range(1)
 
-# In-memory ticket store: ticket_id -> dict
-TICKETS: dict[str, dict] = {}
+@dataclass(slots=True)
+class Ticket:
+    user_id: int
+    name: str
+    jm: str
+    category: str
+    description: str
+    photo_file_id: Optional[str] = None
+    status: str = "open"
+    created_at: float = field(default_factory=time.time)
+    first_response_at: Optional[float] = None
+    assignee: Optional[int] = None
+    csat: Optional[int] = None
+    csat_note: Optional[str] = None
+
+
+# In-memory ticket store: ticket_id -> Ticket
+TICKETS: dict[str, Ticket] = {}
+
+# Max tickets listed by /tickets (keeps the reply under Telegram's 4096 chars)
+TICKETS_LIST_MAX = 50
+
+# Last ticket ids created, oldest first (for /tickets)
+RECENT_TICKETS: deque[str] = deque(maxlen=TICKETS_LIST_MAX)
+
+# Status indexes, kept in sync by set_ticket_status (closed tickets are in neither)
+OPEN_TICKETS: set[str] = set()
+PENDING_TICKETS: set[str] = set()
 
 # Map user_id -> last open ticket_id
 USER_ACTIVE_TICKET: dict[int, str] = {}
 
-# In-memory per-user short session memory (last N exchanges)
+# In-memory per-user short session memory (last N exchanges), LRU over users
 SESSION_HISTORY: dict[int, deque] = {}
 SESSION_MAX_MESSAGES = 6
+SESSION_USERS_MAX = int(os.getenv("SESSION_USERS_MAX", "10000"))
 
-# Simple per-user rate limit (timestamps per command)
-RATE_TRACK: dict[tuple[str,int], deque] = {}
+# Simple per-user rate limit (token bucket per command: tokens, last refill ts)
+RATE_TRACK: dict[tuple[str,int], tuple[float, float]] = {}
 RATE_LIMIT_PER_MIN = int(os.getenv("RATE_LIMIT_PER_MIN", "12"))
+RATE_SWEEP_EVERY = 500
+RATE_IDLE_TTL = 300
+_rate_calls = 0
 
-# Simple FAQ cache (normalized prompt -> reply)
-FAQ_CACHE: OrderedDict[str, str] = OrderedDict()
+# Simple FAQ cache (blake2b digest of normalized prompt -> reply), LRU via dict insertion order
+FAQ_CACHE: dict[bytes, str] = {}
 FAQ_CACHE_MAX = int(os.getenv("FAQ_CACHE_MAX", "200"))
 FAQ_MIN_LEN = 12
 
 # Start time for health
 START_TIME = time.time()
 
+# Access lists parsed once at startup (see load_access_lists)
+_ADMIN_IDS: frozenset[int] = frozenset()
+_MEMBER_IDS: frozenset[int] = frozenset()
+_ALLOW_ALL = False
+ADMIN_GROUP_ID: Optional[int] = None
+
 
 def get_ai_provider() -> str:
     provider = os.getenv("AI_PROVIDER", "openai").strip().lower()
@@ -95,12 +134,49 @@ def get_gen_config() -> tuple[float, int]:
     return temperature, max_tokens
 
 
+@dataclass(frozen=True, slots=True)
+class AIConfig:
+    provider: str
+    model: str
+    temperature: float
+    max_tokens: int
+    openrouter_api_key: str
+    openrouter_site_url: str
+    openrouter_app_name: str
+    groq_api_key: str
+    groq_fallback_model: str
+    ollama_base_url: str
+
+
+# AI settings frozen at startup by load_ai_config()
+AI_CFG: Optional[AIConfig] = None
+
+
+def load_ai_config() -> AIConfig:
+    global AI_CFG
+    provider = get_ai_provider()
+    temperature, max_tokens = get_gen_config()
+    AI_CFG = AIConfig(
+        provider=provider,
+        model=get_ai_model(provider),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        openrouter_api_key=os.getenv("OPENROUTER_API_KEY", ""),
+        openrouter_site_url=os.getenv("OPENROUTER_SITE_URL", "https://localhost"),
+        openrouter_app_name=os.getenv("OPENROUTER_APP_NAME", "Atlas Support Bot"),
+        groq_api_key=os.getenv("GROQ_API_KEY", ""),
+        groq_fallback_model=os.getenv("GROQ_FALLBACK_MODEL", "llama-3.1-8b-instant"),
+        ollama_base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+    )
+    return AI_CFG
+
+
 def allow_all_users() -> bool:
     value = os.getenv("ATLAS_ALLOW_ALL", "").strip().lower()
     return value in {"1", "true", "yes", "on"}
 
 
-def get_admin_ids() -> List[int]:
+def get_admin_ids() -> tuple[int, ...]:
     raw = os.getenv("ATLAS_ADMIN_IDS", "")
     ids: List[int] = []
     for part in raw.split(","):
@@ -110,11 +186,11 @@ def get_admin_ids() -> List[int]:
                 ids.append(int(part))
             except ValueError:
                 logger.warning("ID non valide dans ATLAS_ADMIN_IDS: %s", part)
-    return ids
+    return tuple(ids)
 
 
 def user_is_admin(user_id: int) -> bool:
-    return user_id in get_admin_ids() or user_id in get_allowed_member_ids()
+    return user_id in _ADMIN_IDS or user_id in _MEMBER_IDS
 
 
 def load_environment() -> None:
@@ -130,21 +206,24 @@ def load_environment() -> None:
         if not os.getenv("ATLAS_MEMBER_IDS"):
             missing.append("ATLAS_MEMBER_IDS")
 
-    provider = get_ai_provider()
-    if provider == "openai":
+    cfg = load_ai_config()
+    if cfg.provider == "openai":
         if not os.getenv("OPENAI_API_KEY"):
             missing.append("OPENAI_API_KEY")
-    elif provider == "openrouter":
-        if not os.getenv("OPENROUTER_API_KEY"):
+    elif cfg.provider == "openrouter":
+        if not cfg.openrouter_api_key:
             missing.append("OPENROUTER_API_KEY")
-    elif provider == "groq":
-        if not os.getenv("GROQ_API_KEY"):
+    elif cfg.provider == "groq":
+        if not cfg.groq_api_key:
             missing.append("GROQ_API_KEY")
     # ollama: no API key required (local server)
 
     if missing:
         raise RuntimeError(f"Variables d'environnement manquantes: {', '.join(missing)}")
 
+    load_access_lists()
+    build_satisfaction_keyboard()
+
 
 def get_allowed_member_ids() -> List[int]:
     raw = os.getenv("ATLAS_MEMBER_IDS", "")
@@ -159,26 +238,131 @@ def get_allowed_member_ids() -> List[int]:
     return ids
 
 
+def load_access_lists() -> None:
+    """Parse ATLAS_ADMIN_IDS / ATLAS_MEMBER_IDS / ATLAS_ALLOW_ALL / ADMIN_GROUP_ID into module globals."""
+    global _ADMIN_IDS, _MEMBER_IDS, _ALLOW_ALL, ADMIN_GROUP_ID
+    _ADMIN_IDS = frozenset(get_admin_ids())
+    _MEMBER_IDS = frozenset(get_allowed_member_ids())
+    _ALLOW_ALL = allow_all_users()
+    admin_group = os.getenv("ADMIN_GROUP_ID", "").strip()
+    try:
+        ADMIN_GROUP_ID = int(admin_group) if admin_group else None
+    except ValueError:
+        logger.warning("ADMIN_GROUP_ID non valide: %s", admin_group)
+        ADMIN_GROUP_ID = None
+
+
 def user_is_authorized(user_id: int) -> bool:
-    if allow_all_users():
-        return True
-    return user_id in get_allowed_member_ids()
+    return _ALLOW_ALL or user_id in _MEMBER_IDS
 
 
-def build_openai_client() -> OpenAI:
+def build_openai_client() -> AsyncOpenAI:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY manquant")
-    return OpenAI(api_key=api_key)
+    return AsyncOpenAI(api_key=api_key)
 
 
-def _read_kb_file(path: str) -> str:
+_OPENAI_CLIENT: Optional[AsyncOpenAI] = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    """Return the shared OpenAI client so its connection pool is reused."""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        _OPENAI_CLIENT = build_openai_client()
+    return _OPENAI_CLIENT
+
+
+_HTTPX: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient used for OpenRouter/Groq/Ollama (keep-alive pool)."""
+    global _HTTPX
+    if _HTTPX is None or _HTTPX.is_closed:
+        _HTTPX = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+    return _HTTPX
+
+
+def _json_body(resp: httpx.Response) -> Optional[object]:
+    """Parse a JSON response body once, or None if it is not JSON."""
+    if not resp.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+
+def _read_kb_file(path: str) -> bytes:
     try:
-        with open(path, "r", encoding="utf-8") as f:
+        with open(path, "rb") as f:
             return f.read()
     except Exception as e:
         logger.warning("Impossible de lire %s: %s", path, e)
-        return ""
+        return b""
+
+
+def _iter_kb_files(root: str) -> Iterator[os.DirEntry]:
+    """Yield .md/.txt entries under root, recursively (directory symlinks are not followed)."""
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _iter_kb_files(entry.path)
+                elif entry.name.lower().endswith((".md", ".txt")) and entry.is_file():
+                    yield entry
+    except OSError as e:
+        logger.warning("Impossible de parcourir %s: %s", root, e)
+
+
+SYSTEM_PROMPT_BASE = (
+    "Tu es l'assistant de support officiel d'Atlas Signals.\n"
+    "Rôles et exigences:\n"
+    "- Réponds en français, ton professionnel, empathique, avec quelques emojis adaptés (😊➡️✅❗).\n"
+    "- Réponses courtes et actionnables, étapes numérotées si utile.\n"
+    "- Toujours: reformuler le problème en 1 ligne, proposer 2-5 étapes concrètes,\n"
+    "  et ajouter 'Si ça ne marche pas' avec 1-2 alternatives.\n"
+    "- Domaines: accès groupe, abonnement/paiement, signaux/stratégies, usage Telegram.\n"
+    "- Hors périmètre: indiquer poliment la limite et proposer une ressource.\n"
+)
+
+# Few-shot examples to steer style
+FEW_SHOT_EXAMPLES = [
+    {
+        "role": "user",
+        "content": "Je n'arrive pas à accéder au groupe privé Telegram après mon paiement."
+    },
+    {
+        "role": "assistant",
+        "content": (
+            "Problème: accès au groupe privé après paiement.\n"
+            "1) Vérifiez que votre ID Telegram est bien celui fourni lors de l'inscription. 🙂\n"
+            "2) Redémarrez l'app Telegram puis réessayez l'invitation. 🔄\n"
+            "3) Si vous n'avez pas reçu l'invitation, envoyez votre reçu et votre @username. 🧾\n"
+            "Si ça ne marche pas: répondez avec votre ID (/id) pour vérification. ✅"
+        )
+    },
+]
+
+# System prompt + examples, rebuilt only when BUSINESS_KB changes
+_SYSTEM_PROMPT: str = ""
+_MSG_PREFIX: list[dict] = []
+
+
+def _rebuild_prompt() -> None:
+    global _SYSTEM_PROMPT, _MSG_PREFIX
+    context_header = "\n\nContexte entreprise (résumé, ne pas répéter mot pour mot):\n"
+    kb_section = (context_header + BUSINESS_KB) if BUSINESS_KB else ""
+    _SYSTEM_PROMPT = SYSTEM_PROMPT_BASE + kb_section
+    _MSG_PREFIX = [{"role": "system", "content": _SYSTEM_PROMPT}, *FEW_SHOT_EXAMPLES]
+
+
+_rebuild_prompt()
 
 
 def load_business_kb() -> tuple[int, int]:
@@ -187,6 +371,7 @@ def load_business_kb() -> tuple[int, int]:
     kb_path = os.getenv("ATLAS_KB_PATH", "").strip()
     if not kb_path:
         BUSINESS_KB = ""
+        _rebuild_prompt()
         return (0, 0)
 
     max_chars_env = os.getenv("ATLAS_KB_MAX_CHARS", "100000").strip()
@@ -195,204 +380,222 @@ def load_business_kb() -> tuple[int, int]:
     except ValueError:
         max_chars = 100000
 
-    collected: List[str] = []
+    collected: List[bytes] = []
     files_count = 0
+    total_bytes = 0
 
     if os.path.isdir(kb_path):
-        for root, _dirs, files in os.walk(kb_path):
-            for name in files:
-                if name.lower().endswith((".md", ".txt")):
-                    content = _read_kb_file(os.path.join(root, name))
-                    if content:
-                        collected.append(f"\n\n# {name}\n{content}")
-                        files_count += 1
+        for entry in _iter_kb_files(kb_path):
+            if total_bytes >= max_chars:
+                break
+            data = _read_kb_file(entry.path)
+            if data:
+                chunk = f"\n\n# {entry.name}\n".encode("utf-8") + data
+                collected.append(chunk)
+                total_bytes += len(chunk)
+                files_count += 1
     elif os.path.isfile(kb_path):
         collected.append(_read_kb_file(kb_path))
         files_count = 1
     else:
         logger.warning("ATLAS_KB_PATH introuvable: %s", kb_path)
         BUSINESS_KB = ""
+        _rebuild_prompt()
         return (0, 0)
 
-    kb_full = "\n\n".join(collected)
-    if len(kb_full) > max_chars:
-        kb_full = kb_full[:max_chars]
+    kb_full = b"\n\n".join(collected).decode("utf-8", "ignore")[:max_chars]
     BUSINESS_KB = kb_full
+    _rebuild_prompt()
     logger.info("KB chargée: %d fichiers, %d caractères", files_count, len(BUSINESS_KB))
     return (files_count, len(BUSINESS_KB))
 
 
-async def ask_ai(prompt: str) -> str:
-    context_header = "\n\nContexte entreprise (résumé, ne pas répéter mot pour mot):\n"
-    kb_section = (context_header + BUSINESS_KB) if BUSINESS_KB else ""
+_PUNCT_TABLE = str.maketrans({c: " " for c in string.punctuation})
 
-    system_prompt = (
-        "Tu es l'assistant de support officiel d'Atlas Signals.\n"
-        "Rôles et exigences:\n"
-        "- Réponds en français, ton professionnel, empathique, avec quelques emojis adaptés (😊➡️✅❗).\n"
-        "- Réponses courtes et actionnables, étapes numérotées si utile.\n"
-        "- Toujours: reformuler le problème en 1 ligne, proposer 2-5 étapes concrètes,\n"
-        "  et ajouter 'Si ça ne marche pas' avec 1-2 alternatives.\n"
-        "- Domaines: accès groupe, abonnement/paiement, signaux/stratégies, usage Telegram.\n"
-        "- Hors périmètre: indiquer poliment la limite et proposer une ressource.\n"
-        f"{kb_section}"
-    )
 
-    # Few-shot examples to steer style
-    examples = [
-        {
-            "role": "user",
-            "content": "Je n'arrive pas à accéder au groupe privé Telegram après mon paiement."
-        },
-        {
-            "role": "assistant",
-            "content": (
-                "Problème: accès au groupe privé après paiement.\n"
-                "1) Vérifiez que votre ID Telegram est bien celui fourni lors de l'inscription. 🙂\n"
-                "2) Redémarrez l'app Telegram puis réessayez l'invitation. 🔄\n"
-                "3) Si vous n'avez pas reçu l'invitation, envoyez votre reçu et votre @username. 🧾\n"
-                "Si ça ne marche pas: répondez avec votre ID (/id) pour vérification. ✅"
-            )
-        },
-    ]
+def faq_norm(prompt: str) -> str:
+    """Normalize a prompt for FAQ_CACHE lookups (case, punctuation and whitespace insensitive)."""
+    return " ".join(prompt.lower().translate(_PUNCT_TABLE).split())
 
-    provider = get_ai_provider()
-    model = get_ai_model(provider)
-    temperature, max_tokens = get_gen_config()
 
-    # prepend session history
-    user_id = None
-    try:
-        # will be filled by caller appending; here we just read from context via global not provided, so skip
-        pass
-    except Exception:
-        pass
+def faq_key(norm: str) -> bytes:
+    # fixed-size digest keeps memory and hashing cost independent of prompt length
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=16).digest()
+
+
+def faq_cache_key(prompt: str) -> Optional[bytes]:
+    """FAQ_CACHE key for prompt, or None if it is too short to be worth caching.
+
+    Compute it once per request: pass it to _faq_get and then to complete_ai on a miss.
+    """
+    # cheap pre-check: don't normalize prompts too short to be cached
+    if len(prompt) < FAQ_MIN_LEN:
+        return None
+    norm = faq_norm(prompt)
+    if len(norm) < FAQ_MIN_LEN:
+        return None
+    return faq_key(norm)
+
+
+def _faq_get(key: Optional[bytes]) -> Optional[str]:
+    if key is None:
+        return None
+    reply = FAQ_CACHE.pop(key, None)
+    if reply is not None:
+        # re-insert to mark as most recently used
+        FAQ_CACHE[key] = reply
+    return reply
 
-    try:
-        # FAQ cache hit
-        key = prompt.strip().lower()
-        if len(key) >= FAQ_MIN_LEN and key in FAQ_CACHE:
-            reply = FAQ_CACHE[key]
-            # move to end LRU
-            FAQ_CACHE.move_to_end(key)
-            return reply
 
+def _faq_put(key: Optional[bytes], reply: str) -> None:
+    if key is None:
+        return
+    FAQ_CACHE.pop(key, None)
+    FAQ_CACHE[key] = reply
+    if len(FAQ_CACHE) > FAQ_CACHE_MAX:
+        FAQ_CACHE.pop(next(iter(FAQ_CACHE)))
+
+
+async def ask_ai(prompt: str) -> str:
+    # FAQ cache hit
+    key = faq_cache_key(prompt)
+    cached = _faq_get(key)
+    if cached is not None:
+        return cached
+    return await complete_ai(prompt, key)
+
+
+async def complete_ai(prompt: str, key: Optional[bytes]) -> str:
+    """Query the AI provider without a cache lookup; cache a successful reply under key."""
+    cfg = AI_CFG or load_ai_config()
+    provider = cfg.provider
+    model = cfg.model
+    temperature, max_tokens = cfg.temperature, cfg.max_tokens
+
+    messages = [*_MSG_PREFIX, {"role": "user", "content": prompt}]
+    try:
         if provider == "openai":
-            client = build_openai_client()
-            chat = client.chat.completions.create(
+            client = _get_openai_client()
+            chat = await client.chat.completions.create(
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    *examples,
-                    {"role": "user", "content": prompt},
-                ],
+                messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
-            return chat.choices[0].message.content or "Désolé, je n'ai pas de réponse pour l'instant."
+            content = chat.choices[0].message.content
 
-        if provider == "openrouter":
+        elif provider == "openrouter":
             headers = {
-                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                "HTTP-Referer": os.getenv("OPENROUTER_SITE_URL", "https://localhost"),
-                "X-Title": os.getenv("OPENROUTER_APP_NAME", "Atlas Support Bot"),
+                "Authorization": f"Bearer {cfg.openrouter_api_key}",
+                "HTTP-Referer": cfg.openrouter_site_url,
+                "X-Title": cfg.openrouter_app_name,
                 "Content-Type": "application/json",
             }
             payload = {
                 "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    *examples,
-                    {"role": "user", "content": prompt},
-                ],
+                "messages": messages,
                 "temperature": temperature,
                 "max_tokens": max_tokens,
             }
-            async with httpx.AsyncClient(timeout=60) as client_http:
-                resp = await client_http.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
-                resp.raise_for_status()
-                data = resp.json()
-                content = (
-                    data.get("choices", [{}])[0]
-                    .get("message", {})
-                    .get("content")
-                )
-                return content or "Désolé, je n'ai pas de réponse pour l'instant."
-
-        if provider == "groq":
+            client_http = _get_http_client()
+            resp = await client_http.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
+            resp.raise_for_status()
+            data = resp.json()
+            content = (
+                data.get("choices", [{}])[0]
+                .get("message", {})
+                .get("content")
+            )
+
+        elif provider == "groq":
             headers = {
-                "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
+                "Authorization": f"Bearer {cfg.groq_api_key}",
                 "Content-Type": "application/json",
             }
             payload = {
                 "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    *examples,
-                    {"role": "user", "content": prompt},
-                ],
+                "messages": messages,
                 "temperature": temperature,
                 "max_tokens": max_tokens,
             }
-            async with httpx.AsyncClient(timeout=60) as client_http:
-                resp = await client_http.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
-                if resp.status_code >= 400:
-                    text = resp.text
-                    try:
-                        err = resp.json().get("error")
-                    except Exception:
-                        err = None
-                    logger.error("Groq error %s: %s", resp.status_code, err or text)
-                    fallback_model = os.getenv("GROQ_FALLBACK_MODEL", "llama-3.1-8b-instant")
-                    if fallback_model and fallback_model != model:
-                        payload["model"] = fallback_model
-                        resp = await client_http.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
+            client_http = _get_http_client()
+            resp = await client_http.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
+            if resp.is_error:
+                body = _json_body(resp)
+                err = body.get("error") if isinstance(body, dict) else None
+                logger.error("Groq error %s: %s", resp.status_code, err or resp.text)
+                fallback_model = cfg.groq_fallback_model
+                if fallback_model and fallback_model != model:
+                    payload["model"] = fallback_model
+                    resp = await client_http.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
                 resp.raise_for_status()
-                data = resp.json()
-                content = (
-                    data.get("choices", [{}])[0]
-                    .get("message", {})
-                    .get("content")
-                )
-                return content or "Désolé, je n'ai pas de réponse pour l'instant."
-
-        # ollama (local)
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                *examples,
-                {"role": "user", "content": prompt},
-            ],
-            "stream": False,
-            "options": {"temperature": temperature},
-        }
-        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-        async with httpx.AsyncClient(timeout=120) as client_http:
-            resp = await client_http.post(f"{base_url}/api/chat", json=payload)
+            data = resp.json()
+            content = (
+                data.get("choices", [{}])[0]
+                .get("message", {})
+                .get("content")
+            )
+
+        else:
+            # ollama (local)
+            payload = {
+                "model": model,
+                "messages": messages,
+                "stream": False,
+                "options": {"temperature": temperature},
+            }
+            resp = await _get_http_client().post(f"{cfg.ollama_base_url}/api/chat", json=payload, timeout=120)
             resp.raise_for_status()
             data = resp.json()
             content = (
                 (data.get("message") or {}).get("content")
                 or (data.get("choices", [{}])[0].get("message", {}).get("content"))
             )
-            return content or "Désolé, je n'ai pas de réponse pour l'instant."
-
-        # After success, store in FAQ cache
     except Exception as e:
         logger.exception("Erreur IA (%s): %s", provider, e)
         return "Une erreur est survenue avec le service IA. Réessayez plus tard."
 
+    if not content:
+        return "Désolé, je n'ai pas de réponse pour l'instant."
 
-def satisfaction_keyboard() -> InlineKeyboardMarkup:
+    # After success, store in FAQ cache
+    _faq_put(key, content)
+    return content
+
+
+SATISFACTION_KB: Optional[InlineKeyboardMarkup] = None
+
+
+def build_satisfaction_keyboard() -> InlineKeyboardMarkup:
+    global SATISFACTION_KB
     site = os.getenv("ATLAS_SITE_URL", "https://atlassignals.site")
-    return InlineKeyboardMarkup([
+    SATISFACTION_KB = InlineKeyboardMarkup([
         [
             InlineKeyboardButton(text="👍 Résolu", callback_data="SAT_OK"),
             InlineKeyboardButton(text="❗ Besoin d'aide", callback_data="SAT_NEED_HELP"),
         ],
         [InlineKeyboardButton(text="📚 Voir FAQ", url=site)]
     ])
+    return SATISFACTION_KB
+
+
+def satisfaction_keyboard() -> InlineKeyboardMarkup:
+    return SATISFACTION_KB or build_satisfaction_keyboard()
+
+
+# CSAT rating keyboard: rows of (label, score); only the ticket id varies
+CSAT_TEMPLATE = "CSAT:{tid}:{n}"
+CSAT_ROWS = (
+    (("⭐", 1), ("⭐⭐", 2), ("⭐⭐⭐", 3)),
+    (("⭐⭐⭐⭐", 4), ("⭐⭐⭐⭐⭐", 5)),
+)
+
+
+def csat_kb(ticket_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=CSAT_TEMPLATE.format(tid=ticket_id, n=n)) for label, n in row]
+        for row in CSAT_ROWS
+    ])
 
 
 async def satisfaction_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -406,6 +609,85 @@ async def satisfaction_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.reply_text("Super, ravi d'avoir pu aider ! 😊")
 
 
+# ---------------------- Envoi Telegram ----------------------
+class SendQueue:
+    """Single outbound queue for bot sends, paced under Telegram's bot-wide limit (~30 msg/s)."""
+
+    def __init__(self, rate_per_s: int = 30, max_in_flight: int = 30) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._sem = asyncio.Semaphore(max_in_flight)
+        # start times of the last rate_per_s sends (1s sliding window)
+        self._window: deque[float] = deque(maxlen=rate_per_s)
+        self._inflight: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        inflight = list(self._inflight)
+        for task in inflight:
+            task.cancel()
+        await asyncio.gather(*inflight, return_exceptions=True)
+        while not self._queue.empty():
+            _send, _kwargs, fut = self._queue.get_nowait()
+            fut.cancel()
+
+    async def submit(self, send, /, **kwargs):
+        """Queue send(**kwargs), e.g. bot.send_message, and wait for its result."""
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((send, kwargs, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            send, kwargs, fut = await self._queue.get()
+            if fut.done():
+                continue
+            try:
+                await self._throttle()
+            except asyncio.CancelledError:
+                # dequeued but never sent: release the waiting submit()
+                fut.cancel()
+                raise
+            task = asyncio.create_task(self._send(send, kwargs, fut))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _throttle(self) -> None:
+        if len(self._window) == self._window.maxlen:
+            wait = 1.0 - (time.monotonic() - self._window[0])
+            if wait > 0:
+                await asyncio.sleep(wait)
+        self._window.append(time.monotonic())
+
+    async def _send(self, send, kwargs: dict, fut: asyncio.Future) -> None:
+        try:
+            async with self._sem:
+                result = await send(**kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(result)
+
+
+send_queue = SendQueue()
+
+
 # ---------------------- Handlers Telegram ----------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
@@ -460,6 +742,16 @@ async def reload_kb_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
+def set_ticket_status(ticket_id: str, status: str) -> None:
+    TICKETS[ticket_id].status = status
+    OPEN_TICKETS.discard(ticket_id)
+    PENDING_TICKETS.discard(ticket_id)
+    if status == "open":
+        OPEN_TICKETS.add(ticket_id)
+    elif status == "pending":
+        PENDING_TICKETS.add(ticket_id)
+
+
 # Support conversation flow
 async def support_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -468,7 +760,7 @@ async def support_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     # If user has active open ticket, guide them to reply on it
     tid = USER_ACTIVE_TICKET.get(user.id)
-    if tid and TICKETS.get(tid, {}).get("status") != "closed":
+    if tid and tid in TICKETS and TICKETS[tid].status != "closed":
         await update.effective_message.reply_text(
             f"Vous avez déjà un ticket ouvert: #{tid}.\n"
             f"Répondez directement à un message du support ou utilisez /reply <votre message>."
@@ -487,7 +779,7 @@ async def support_entry_from_button(update: Update, context: ContextTypes.DEFAUL
     user = update.effective_user
     if user:
         tid = USER_ACTIVE_TICKET.get(user.id)
-        if tid and TICKETS.get(tid, {}).get("status") != "closed":
+        if tid and tid in TICKETS and TICKETS[tid].status != "closed":
             await query.message.reply_text(
                 f"Vous avez déjà un ticket ouvert: #{tid}.\n"
                 f"Répondez directement au dernier message du support ou utilisez /reply <votre message>."
@@ -502,46 +794,70 @@ async def support_ask_jm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASK_JM
 
 
+# Ticket category buttons: callback data -> label
+CAT_MAP = {
+    "CAT_ACCESS": "Accès / Invitation",
+    "CAT_PAYMENT": "Paiement / Facturation",
+    "CAT_SIGNALS": "Signaux / Trading",
+    "CAT_OTHER": "Autre",
+}
+_CAT_KB = InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=data)] for data, label in CAT_MAP.items()])
+
+
 async def support_ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["jm"] = (update.effective_message.text or "").strip()
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Accès / Invitation", callback_data="CAT_ACCESS")],
-        [InlineKeyboardButton("Paiement / Facturation", callback_data="CAT_PAYMENT")],
-        [InlineKeyboardButton("Signaux / Trading", callback_data="CAT_SIGNALS")],
-        [InlineKeyboardButton("Autre", callback_data="CAT_OTHER")],
-    ])
-    await update.effective_message.reply_text("Quelle est la catégorie du problème ?", reply_markup=kb)
+    await update.effective_message.reply_text("Quelle est la catégorie du problème ?", reply_markup=_CAT_KB)
     return ASK_CATEGORY
 
 
 async def support_ask_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    mapping = {
-        "CAT_ACCESS": "Accès / Invitation",
-        "CAT_PAYMENT": "Paiement / Facturation",
-        "CAT_SIGNALS": "Signaux / Trading",
-        "CAT_OTHER": "Autre",
-    }
-    context.user_data["category"] = mapping.get(query.data, "Autre")
+    context.user_data["category"] = CAT_MAP.get(query.data, "Autre")
     await query.edit_message_reply_markup(reply_markup=None)
     await query.message.reply_text("Merci 🙏. Décrivez brièvement le problème (avec détails utiles).")
     return ASK_DESCRIPTION
 
 
+# Keyword stems per category for auto-categorizing 'Autre' tickets without an LLM call
+CAT_KEYWORDS = {
+    "Accès / Invitation": ("acc[eè]s", "acc[eé]d", "invit", r"groupes?\b", r"liens?\b", "rejoin"),
+    "Paiement / Facturation": ("paie", "pay[eé]", "paypal", "factur", "stripe", "rembours", r"cartes?\b"),
+    "Signaux / Trading": (r"signa(?:l|ls|ux)\b", r"trad(?:e|es|er|ers|ing)\b", r"sl\b", r"tp\b", r"lots?\b", r"pips?\b"),
+}
+CAT_PATTERNS = {
+    cat: re.compile(r"\b(?:" + "|".join(words) + ")", re.IGNORECASE)
+    for cat, words in CAT_KEYWORDS.items()
+}
+
+
+def guess_category(text: str) -> Optional[str]:
+    """Return the category with the most keyword hits, or None if nothing matches."""
+    best, best_hits = None, 0
+    for cat, pattern in CAT_PATTERNS.items():
+        hits = len(pattern.findall(text))
+        if hits > best_hits:
+            best, best_hits = cat, hits
+    return best
+
+
 async def support_ask_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["description"] = (update.effective_message.text or "").strip()
     # Auto-categorize if 'Autre'
     if context.user_data.get("category") == "Autre":
         desc = context.user_data["description"]
         lang = detect_language(desc)
-        hint_prompt = (
-            "Catégorise ce problème parmi: Accès / Invitation, Paiement / Facturation, "
-            "Signaux / Trading, Autre. Réponds uniquement par le libellé.\n\n" + desc
-        )
-        cat = await ask_ai(hint_prompt)
+        cat = guess_category(desc)
         if cat:
-            context.user_data["category"] = (cat.split("\n")[0] or cat).strip()
+            context.user_data["category"] = cat
+        else:
+            hint_prompt = (
+                "Catégorise ce problème parmi: Accès / Invitation, Paiement / Facturation, "
+                "Signaux / Trading, Autre. Réponds uniquement par le libellé.\n\n" + desc
+            )
+            cat = await ask_ai(hint_prompt)
+            if cat:
+                context.user_data["category"] = (cat.split("\n")[0] or cat).strip()
     await update.effective_message.reply_text("Pouvez-vous joindre une capture d'écran ? (envoyez une image ou tapez 'skip') 🖼️")
     return ASK_SCREENSHOT
 
@@ -566,6 +882,13 @@ async def support_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CONFIRM_SEND
 
 
+async def _send_ticket_to(bot, chat_id: int, text: str, kb: InlineKeyboardMarkup, ticket_id: str, photo_file_id: Optional[str]) -> None:
+    # message first, then the screenshot, so the photo follows its ticket in the chat
+    await send_queue.submit(bot.send_message, chat_id=chat_id, text=text, reply_markup=kb)
+    if photo_file_id:
+        await send_queue.submit(bot.send_photo, chat_id=chat_id, photo=photo_file_id, caption=f"Ticket #{ticket_id}")
+
+
 async def support_send_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -573,7 +896,7 @@ async def support_send_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     # Guard: prevent duplicate if open exists
     existing_tid = USER_ACTIVE_TICKET.get(user.id)
-    if existing_tid and TICKETS.get(existing_tid, {}).get("status") != "closed":
+    if existing_tid and existing_tid in TICKETS and TICKETS[existing_tid].status != "closed":
         await query.message.reply_text(
             f"Un ticket est déjà ouvert: #{existing_tid}.\n"
             f"Répondez avec /reply ou au message du support."
@@ -582,29 +905,25 @@ async def support_send_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
     # Create ticket id
     ticket_id = str(int(time.time() * 1000))
-    TICKETS[ticket_id] = {
-        "user_id": user.id,
-        "name": context.user_data.get('name',''),
-        "jm": context.user_data.get('jm',''),
-        "category": context.user_data.get('category',''),
-        "description": context.user_data.get('description',''),
-        "photo_file_id": context.user_data.get('photo_file_id'),
-        "status": "open",
-        "created_at": time.time(),
-        "first_response_at": None,
-        "assignee": None,
-        "csat": None,
-        "csat_note": None,
-    }
+    ticket = TICKETS[ticket_id] = Ticket(
+        user_id=user.id,
+        name=context.user_data.get('name',''),
+        jm=context.user_data.get('jm',''),
+        category=context.user_data.get('category',''),
+        description=context.user_data.get('description',''),
+        photo_file_id=context.user_data.get('photo_file_id'),
+    )
+    set_ticket_status(ticket_id, "open")
+    RECENT_TICKETS.append(ticket_id)
     # mark as user's active open ticket
     USER_ACTIVE_TICKET[user.id] = ticket_id
     text = (
         f"🆘 Ticket #{ticket_id}\n"
-        f"Nom: {TICKETS[ticket_id]['name']}\n"
-        f"JM: {TICKETS[ticket_id]['jm']}\n"
+        f"Nom: {ticket.name}\n"
+        f"JM: {ticket.jm}\n"
         f"Client ID: {user.id}\n"
-        f"Catégorie: {TICKETS[ticket_id]['category']}\n"
-        f"Description: {TICKETS[ticket_id]['description']}\n"
+        f"Catégorie: {ticket.category}\n"
+        f"Description: {ticket.description}\n"
     )
     kb = InlineKeyboardMarkup([
         [
@@ -612,23 +931,21 @@ async def support_send_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE
             InlineKeyboardButton("Clore ✅", callback_data=f"ADM_CLOSE:{ticket_id}"),
         ]
     ])
-    admin_group = os.getenv("ADMIN_GROUP_ID", "").strip()
-    if admin_group:
+    photo_file_id = ticket.photo_file_id
+    if ADMIN_GROUP_ID is not None:
         try:
-            await context.bot.send_message(chat_id=int(admin_group), text=text, reply_markup=kb)
-            if TICKETS[ticket_id]["photo_file_id"]:
-                await context.bot.send_photo(chat_id=int(admin_group), photo=TICKETS[ticket_id]["photo_file_id"], caption=f"Ticket #{ticket_id}")
+            await _send_ticket_to(context.bot, ADMIN_GROUP_ID, text, kb, ticket_id, photo_file_id)
         except Exception as e:
             logger.warning("Envoi au groupe admin échoué: %s", e)
     else:
-        admin_ids = get_admin_ids()
-        for admin_id in admin_ids:
-            try:
-                await context.bot.send_message(chat_id=admin_id, text=text, reply_markup=kb)
-                if TICKETS[ticket_id]["photo_file_id"]:
-                    await context.bot.send_photo(chat_id=admin_id, photo=TICKETS[ticket_id]["photo_file_id"], caption=f"Ticket #{ticket_id}")
-            except Exception as e:
-                logger.warning("Envoi au admin %s échoué: %s", admin_id, e)
+        admin_ids = tuple(_ADMIN_IDS)
+        results = await asyncio.gather(
+            *(_send_ticket_to(context.bot, admin_id, text, kb, ticket_id, photo_file_id) for admin_id in admin_ids),
+            return_exceptions=True,
+        )
+        for admin_id, result in zip(admin_ids, results):
+            if isinstance(result, Exception):
+                logger.warning("Envoi au admin %s échoué: %s", admin_id, result)
     await query.message.reply_text(
         f"Merci ✅😊 Votre demande a été envoyée à un administrateur.\n"
         f"Votre numéro de ticket: #{ticket_id}. Conservez-le pour le suivi."
@@ -662,12 +979,12 @@ async def admin_reply_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     reply_text = update.effective_message.text or ""
     # mark first_response_at
-    if ticket.get("first_response_at") is None:
-        ticket["first_response_at"] = time.time()
-        ticket["status"] = "pending"
+    if ticket.first_response_at is None:
+        ticket.first_response_at = time.time()
+        set_ticket_status(ticket_id, "pending")
     # Send to customer
     try:
-        await context.bot.send_message(chat_id=ticket["user_id"], text=f"📣 Réponse du support (ticket #{ticket_id}):\n{reply_text}")
+        await send_queue.submit(context.bot.send_message, chat_id=ticket.user_id, text=f"📣 Réponse du support (ticket #{ticket_id}):\n{reply_text}")
         await update.effective_message.reply_text("Réponse envoyée au client ✅")
     except Exception as e:
         await update.effective_message.reply_text(f"Échec d'envoi au client: {e}")
@@ -684,24 +1001,20 @@ async def admin_close_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not ticket:
         await query.message.reply_text("Ticket introuvable ou déjà clos.")
         return
-    ticket["status"] = "closed"
+    set_ticket_status(ticket_id, "closed")
     await query.edit_message_reply_markup(reply_markup=None)
     await query.message.reply_text(f"Ticket #{ticket_id} clôturé ✅")
     # clear active map if matches
-    if USER_ACTIVE_TICKET.get(ticket["user_id"]) == ticket_id:
-        USER_ACTIVE_TICKET.pop(ticket["user_id"], None)
+    if USER_ACTIVE_TICKET.get(ticket.user_id) == ticket_id:
+        USER_ACTIVE_TICKET.pop(ticket.user_id, None)
     # Notify client about closure
     try:
-        await context.bot.send_message(chat_id=ticket["user_id"], text=f"✅ Votre ticket #{ticket_id} a été clôturé. Si besoin, vous pouvez créer un nouveau ticket avec /support.")
+        await send_queue.submit(context.bot.send_message, chat_id=ticket.user_id, text=f"✅ Votre ticket #{ticket_id} a été clôturé. Si besoin, vous pouvez créer un nouveau ticket avec /support.")
     except Exception as e:
         logger.warning("Notification close client échouée: %s", e)
     # Ask CSAT to customer
     try:
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("⭐", callback_data=f"CSAT:{ticket_id}:1"), InlineKeyboardButton("⭐⭐", callback_data=f"CSAT:{ticket_id}:2"), InlineKeyboardButton("⭐⭐⭐", callback_data=f"CSAT:{ticket_id}:3")],
-            [InlineKeyboardButton("⭐⭐⭐⭐", callback_data=f"CSAT:{ticket_id}:4"), InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data=f"CSAT:{ticket_id}:5")],
-        ])
-        await context.bot.send_message(chat_id=ticket["user_id"], text=f"Merci pour votre patience 🙏\nÉvaluez notre aide pour le ticket #{ticket_id}:", reply_markup=kb)
+        await send_queue.submit(context.bot.send_message, chat_id=ticket.user_id, text=f"Merci pour votre patience 🙏\nÉvaluez notre aide pour le ticket #{ticket_id}:", reply_markup=csat_kb(ticket_id))
     except Exception as e:
         logger.warning("CSAT non envoyé: %s", e)
 
@@ -714,7 +1027,7 @@ async def csat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ticket = TICKETS.get(ticket_id)
     if not ticket:
         return
-    ticket["csat"] = int(score)
+    ticket.csat = int(score)
     await query.edit_message_reply_markup(reply_markup=None)
     await query.message.reply_text("Merci pour votre retour ⭐")
 
@@ -722,10 +1035,18 @@ async def csat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def tickets_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user_is_admin(update.effective_user.id):
         return
+    # /tickets active -> newest open + pending; default -> last created
+    if context.args and context.args[0].lower() == "active":
+        tids = sorted(OPEN_TICKETS | PENDING_TICKETS)[-TICKETS_LIST_MAX:]
+    else:
+        tids = RECENT_TICKETS
     lines = []
-    for tid, t in list(TICKETS.items())[-50:]:
-        age = int(time.time() - t.get("created_at", time.time()))
-        lines.append(f"#{tid} | {t['status']} | @{t.get('assignee','-')} | {t['category']} | {age}s")
+    for tid in tids:
+        t = TICKETS.get(tid)
+        if not t:
+            continue
+        age = int(time.time() - t.created_at)
+        lines.append(f"#{tid} | {t.status} | @{t.assignee or '-'} | {t.category} | {age}s")
     await update.effective_message.reply_text("\n".join(lines) or "Aucun ticket")
 
 async def ticket_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -736,10 +1057,10 @@ async def ticket_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not t:
         await update.effective_message.reply_text("Ticket introuvable")
         return
-    age = int(time.time() - t.get("created_at", time.time()))
-    frt = (t.get("first_response_at") and int(t["first_response_at"] - t["created_at"])) or "-"
+    age = int(time.time() - t.created_at)
+    frt = (t.first_response_at and int(t.first_response_at - t.created_at)) or "-"
     await update.effective_message.reply_text(
-        f"Ticket #{tid}\nStatut: {t['status']}\nAssignee: {t.get('assignee','-')}\nCatégorie: {t['category']}\nFRT: {frt}s\nÂge: {age}s\nClient: {t['user_id']}\nNom: {t['name']}\nJM: {t['jm']}\nDesc: {t['description']}"
+        f"Ticket #{tid}\nStatut: {t.status}\nAssignee: {t.assignee or '-'}\nCatégorie: {t.category}\nFRT: {frt}s\nÂge: {age}s\nClient: {t.user_id}\nNom: {t.name}\nJM: {t.jm}\nDesc: {t.description}"
     )
 
 async def ticket_close_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -754,7 +1075,7 @@ async def ticket_close_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = DummyQ(); q.data = f"ADM_CLOSE:{tid}"; q.message = update.effective_message
     await admin_close_ticket(Update(update.update_id, callback_query=None), context)  # no-op; we call directly below
     # directly close
-    TICKETS[tid]["status"] = "closed"
+    set_ticket_status(tid, "closed")
     await update.effective_message.reply_text(f"Ticket #{tid} clôturé ✅")
 
 async def ticket_assign_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -763,13 +1084,35 @@ async def ticket_assign_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) < 2:
         await update.effective_message.reply_text("Usage: /assign <ticket_id> <admin_id>")
         return
-    tid, aid = context.args[0], context.args[1]
+    tid = context.args[0]
+    try:
+        aid = int(context.args[1])
+    except ValueError:
+        await update.effective_message.reply_text("admin_id doit être un ID Telegram numérique")
+        return
     if tid not in TICKETS:
         await update.effective_message.reply_text("Ticket introuvable")
         return
-    TICKETS[tid]["assignee"] = aid
+    TICKETS[tid].assignee = aid
     await update.effective_message.reply_text(f"Ticket #{tid} assigné à {aid}")
 
+async def forward_to_staff(context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    """Send text to the admin group if configured, otherwise to every admin concurrently."""
+    if ADMIN_GROUP_ID is not None:
+        try:
+            await send_queue.submit(context.bot.send_message, chat_id=ADMIN_GROUP_ID, text=text)
+        except Exception as e:
+            logger.warning("Transmission de la réponse au staff échouée: %s", e)
+        return
+    results = await asyncio.gather(
+        *(send_queue.submit(context.bot.send_message, chat_id=admin_id, text=text) for admin_id in _ADMIN_IDS),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("Transmission de la réponse au staff échouée: %s", result)
+
+
 # Client replies to open ticket
 async def client_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -786,7 +1129,7 @@ async def client_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("Aucun ticket ouvert trouvé. Utilisez /support pour en créer un." )
         return
     t = TICKETS[tid]
-    if t.get("status") == "closed":
+    if t.status == "closed":
         await update.effective_message.reply_text("Ce ticket est déjà clôturé. Utilisez /support pour en créer un nouveau." )
         return
     # message after command args
@@ -795,45 +1138,62 @@ async def client_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("Usage: /reply <ticket_id?> <votre message>")
         return
     # forward to admins or group
-    admin_group = os.getenv("ADMIN_GROUP_ID", "").strip()
     fwd = f"🔁 Réponse client pour ticket #{tid}\nClient {user.id}: {reply_text}"
-    try:
-        if admin_group:
-            await context.bot.send_message(chat_id=int(admin_group), text=fwd)
-        else:
-            for admin_id in get_admin_ids():
-                await context.bot.send_message(chat_id=admin_id, text=fwd)
-    except Exception as e:
-        logger.warning("Transmission de la réponse au staff échouée: %s", e)
+    await forward_to_staff(context, fwd)
     await update.effective_message.reply_text("Message envoyé au support ✅")
 
 # Language detection heuristic
 FR_HINTS = {"bonjour","svp","merci","problème","paiement","accès","s'il","ça","été","é","à","è","ù"}
+FR_HINT_RE = re.compile("|".join(sorted((re.escape(w) for w in FR_HINTS), key=len, reverse=True)), re.IGNORECASE)
+FR_HINT_WINDOW = 2048
 
 def detect_language(text: str) -> str:
-    t = (text or "").lower()
-    score_fr = sum(1 for w in FR_HINTS if w in t)
-    return "fr" if score_fr >= 1 else "en"
+    # hints show up early; no need to scan (or lowercase) the whole message
+    return "fr" if text and FR_HINT_RE.search(text, 0, FR_HINT_WINDOW) else "en"
 
 # Rate limiting
 
 def check_rate_limit(user_id: int, command: str) -> bool:
+    global _rate_calls
     key = (command, user_id)
-    dq = RATE_TRACK.setdefault(key, deque())
-    now = time.time()
-    # drop older than 60s
-    while dq and now - dq[0] > 60:
-        dq.popleft()
-    if len(dq) >= RATE_LIMIT_PER_MIN:
-        return False
-    dq.append(now)
-    return True
+    now = time.monotonic()
+    cap = float(RATE_LIMIT_PER_MIN)
+    tokens, last = RATE_TRACK.get(key, (cap, now))
+    # refill at RATE_LIMIT_PER_MIN tokens per 60s
+    tokens = min(cap, tokens + (now - last) * cap / 60)
+    allowed = tokens >= 1
+    RATE_TRACK[key] = (tokens - 1 if allowed else tokens, now)
+    # drop idle buckets from time to time to bound memory
+    _rate_calls += 1
+    if _rate_calls >= RATE_SWEEP_EVERY:
+        _rate_calls = 0
+        for k in [k for k, (_, ts) in RATE_TRACK.items() if now - ts > RATE_IDLE_TTL]:
+            del RATE_TRACK[k]
+    return allowed
 
 # Session memory helper
 
+def get_session(user_id: int) -> deque:
+    """Return the user's history, marking it most recently used and evicting the coldest user."""
+    dq = SESSION_HISTORY.pop(user_id, None)
+    if dq is None:
+        dq = deque(maxlen=SESSION_MAX_MESSAGES)
+    SESSION_HISTORY[user_id] = dq
+    if len(SESSION_HISTORY) > SESSION_USERS_MAX:
+        SESSION_HISTORY.pop(next(iter(SESSION_HISTORY)))
+    return dq
+
+
 def append_history(user_id: int, role: str, content: str) -> None:
-    dq = SESSION_HISTORY.setdefault(user_id, deque(maxlen=SESSION_MAX_MESSAGES))
-    dq.append({"role": role, "content": content})
+    get_session(user_id).append({"role": role, "content": content})
+
+
+async def _send_typing(chat) -> None:
+    # cosmetic only: never let a failed chat action break the reply
+    try:
+        await chat.send_action(action=ChatAction.TYPING)
+    except Exception as e:
+        logger.debug("Indicateur de saisie non envoyé: %s", e)
 
 
 async def ask_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -857,18 +1217,21 @@ async def ask_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     lang = detect_language(question)
     append_history(user.id, "user", question)
-    await update.effective_message.chat.send_action(action=ChatAction.TYPING)
-    reply = await ask_ai(question)
+    # FAQ hit: answer right away, no typing indicator or LLM round-trip
+    key = faq_cache_key(question)
+    reply = _faq_get(key)
+    if reply is None:
+        typing = asyncio.create_task(_send_typing(update.effective_message.chat))
+        reply = await complete_ai(question, key)
+        await typing
     append_history(user.id, "assistant", reply)
-    # add to cache
-    key = question.strip().lower()
-    if len(key) >= FAQ_MIN_LEN:
-        FAQ_CACHE[key] = reply
-        if len(FAQ_CACHE) > FAQ_CACHE_MAX:
-            FAQ_CACHE.popitem(last=False)
     await update.effective_message.reply_text(reply, parse_mode=ParseMode.MARKDOWN, reply_markup=satisfaction_keyboard())
 
 
+# "ticket #123" in a support message the user is replying to
+TICKET_ID_RE = re.compile(r"ticket\s*#(\d+)", re.IGNORECASE)
+
+
 async def inbound_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     user = update.effective_user
@@ -882,28 +1245,16 @@ async def inbound_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     # If user replies to a support message containing a ticket id, route as a client reply
-    try:
-        import re
-        if message.reply_to_message and message.reply_to_message.text:
-            m = re.search(r"ticket\s*#(\d+)", message.reply_to_message.text, flags=re.IGNORECASE)
-            if m:
-                tid = m.group(1)
-                t = TICKETS.get(tid)
-                if t and t.get("status") != "closed":
-                    admin_group = os.getenv("ADMIN_GROUP_ID", "").strip()
-                    fwd = f"🔁 Réponse client pour ticket #{tid}\nClient {user.id}: {message.text}"
-                    try:
-                        if admin_group:
-                            await context.bot.send_message(chat_id=int(admin_group), text=fwd)
-                        else:
-                            for admin_id in get_admin_ids():
-                                await context.bot.send_message(chat_id=admin_id, text=fwd)
-                    except Exception as e:
-                        logger.warning("Transmission de la réponse au staff échouée: %s", e)
-                    await message.reply_text("Message envoyé au support ✅")
-                    return
-    except Exception as e:
-        logger.debug("Reply-to routing non appliqué: %s", e)
+    if message.reply_to_message and message.reply_to_message.text:
+        m = TICKET_ID_RE.search(message.reply_to_message.text)
+        if m:
+            tid = m.group(1)
+            t = TICKETS.get(tid)
+            if t and t.status != "closed":
+                fwd = f"🔁 Réponse client pour ticket #{tid}\nClient {user.id}: {message.text}"
+                await forward_to_staff(context, fwd)
+                await message.reply_text("Message envoyé au support ✅")
+                return
 
     prompt = message.text or ""
     if not prompt:
@@ -915,50 +1266,93 @@ async def inbound_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     append_history(user.id, "user", prompt)
-    await message.chat.send_action(action=ChatAction.TYPING)
-    reply = await ask_ai(prompt)
+    # FAQ hit: answer right away, no typing indicator or LLM round-trip
+    key = faq_cache_key(prompt)
+    reply = _faq_get(key)
+    if reply is None:
+        typing = asyncio.create_task(_send_typing(message.chat))
+        reply = await complete_ai(prompt, key)
+        await typing
     append_history(user.id, "assistant", reply)
-    key = prompt.strip().lower()
-    if len(key) >= FAQ_MIN_LEN:
-        FAQ_CACHE[key] = reply
-        if len(FAQ_CACHE) > FAQ_CACHE_MAX:
-            FAQ_CACHE.popitem(last=False)
     await message.reply_text(reply, parse_mode=ParseMode.MARKDOWN, reply_markup=satisfaction_keyboard())
 
 
+# Top-level callback queries (conversation callbacks stay on their ConversationHandlers)
+CALLBACK_DISPATCH = {
+    "ADM_CLOSE": admin_close_ticket,
+    "CSAT": csat_handler,
+    "SAT_OK": satisfaction_callback,  # SAT_NEED_HELP is the /support conversation entry point
+}
+CALLBACK_ROUTER_PATTERN = r"^(?:ADM_CLOSE:|CSAT:|SAT_OK$)"
+
+
+async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    kind = (update.callback_query.data or "").partition(":")[0]
+    handler = CALLBACK_DISPATCH.get(kind)
+    if handler:
+        return await handler(update, context)
+
+
 # ---------------------- Health Server ----------------------
 async def handle_health(request: web.Request) -> web.Response:
     uptime = int(time.time() - START_TIME)
     payload = {
         "status": "ok",
         "uptime_s": uptime,
-        "tickets_open": sum(1 for t in TICKETS.values() if t.get("status") != "closed"),
+        "tickets_open": len(OPEN_TICKETS) + len(PENDING_TICKETS),
         "faq_cache": len(FAQ_CACHE),
     }
     return web.json_response(payload)
 
 
-def run_health_server() -> None:
+_HEALTH_RUNNER: Optional[web.AppRunner] = None
+
+
+async def start_health_server() -> None:
+    """Serve /healthz from the bot's own event loop."""
+    global _HEALTH_RUNNER
     try:
         app = web.Application()
         app.router.add_get("/healthz", handle_health)
+        runner = web.AppRunner(app)
+        await runner.setup()
         port = int(os.getenv("PORT", "8000"))
-        web.run_app(app, port=port)
+        await web.TCPSite(runner, port=port).start()
+        _HEALTH_RUNNER = runner
     except Exception as e:
         logger.warning("Health server stopped: %s", e)
 
 
 # ---------------------- Entrée Programme ----------------------
+async def post_init(application: Application) -> None:
+    _get_http_client()
+    send_queue.start()
+    await start_health_server()
+
+
+async def post_shutdown(application: Application) -> None:
+    await send_queue.stop()
+    if _HEALTH_RUNNER is not None:
+        await _HEALTH_RUNNER.cleanup()
+    if _HTTPX is not None:
+        await _HTTPX.aclose()
+    if _OPENAI_CLIENT is not None:
+        await _OPENAI_CLIENT.close()
+
+
 def main() -> None:
     load_environment()
     # Preload KB if configured
     load_business_kb()
 
     token = os.getenv("TELEGRAM_BOT_TOKEN")
-    application = Application.builder().token(token).build()
-
-    # Start health server in background
-    threading.Thread(target=run_health_server, daemon=True).start()
+    application = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_cmd))
@@ -999,11 +1393,8 @@ def main() -> None:
     )
     application.add_handler(admin_reply_conv)
 
-    # Close ticket handler
-    application.add_handler(CallbackQueryHandler(admin_close_ticket, pattern="^ADM_CLOSE:"))
-
-    # CSAT handler
-    application.add_handler(CallbackQueryHandler(csat_handler, pattern="^CSAT:"))
+    # Close ticket, CSAT and satisfaction buttons: one handler, dict dispatch
+    application.add_handler(CallbackQueryHandler(callback_router, pattern=CALLBACK_ROUTER_PATTERN))
 
     # Admin commands
     application.add_handler(CommandHandler("tickets", tickets_list))
@@ -1012,13 +1403,14 @@ def main() -> None:
     application.add_handler(CommandHandler("assign", ticket_assign_cmd))
     application.add_handler(CommandHandler("reply", client_reply))
 
-    # Satisfaction buttons handler (only SAT_OK here)
-    application.add_handler(CallbackQueryHandler(satisfaction_callback, pattern="^SAT_OK$"))
-
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, inbound_message))
 
     logger.info("Bot démarré. En attente de messages...")
-    application.run_polling()
+    # Only the update types handled above; skip the backlog queued while offline
+    application.run_polling(
+        allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],
+        drop_pending_updates=True,
+    )
 
 
 if __name__ == "__main__":